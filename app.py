@@ -5,12 +5,18 @@
 # It communicates with the FastAPI backend to perform AI-powered operations.
 
 import streamlit as st
-import requests
+import httpx
+import gzip
+import hashlib
 import json
+import threading
 import time
+from collections import OrderedDict
 
 # --- Configuration ---
 BACKEND_URL = "http://localhost:8000" # URL of your FastAPI backend
+STREAM_ERROR_MARKER = "\n[[stream interrupted]]" # Must match STREAM_ERROR_MARKER in main.py
+SUMMARY_CACHE_MAX_ENTRIES = 64
 
 # --- Streamlit UI Setup ---
 st.set_page_config(
@@ -19,6 +25,99 @@ st.set_page_config(
     initial_sidebar_state="auto"
 )
 
+# --- Backend Client ---
+@st.cache_resource
+def get_client() -> httpx.Client:
+    """
+    One pooled HTTP client per Streamlit process, so backend calls reuse keep-alive connections.
+    """
+    return httpx.Client(base_url=BACKEND_URL, timeout=60.0)
+
+# --- Backend Calls ---
+# Uploads are not cached: the backend dedups documents by content hash, and a cached file_id
+# would go stale once the backend restarts or evicts the document.
+def upload_to_backend(file_bytes: bytes, filename: str, content_type: str) -> dict:
+    """
+    Uploads the document to the backend for extraction as a gzip-compressed request body.
+    Returns the backend file_id and the upload message.
+    """
+    response = get_client().post(
+        "/upload_document",
+        params={"filename": filename},
+        content=gzip.compress(file_bytes, compresslevel=6), # Level 6 keeps compression fast for large files
+        headers={"Content-Encoding": "gzip", "Content-Type": content_type}
+    )
+    response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
+    result = response.json()
+    return {
+        "file_id": result.get("file_id"),
+        "message": result.get("message", "Document uploaded successfully!")
+    }
+
+class SummaryCache:
+    """
+    Completed summaries keyed by file_id, evicting the least recently used entry once full.
+    Streamed output cannot go through st.cache_data, so this is shared via st.cache_resource;
+    the lock guards it across concurrent Streamlit sessions.
+    """
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, file_id: str):
+        with self.lock:
+            summary = self.entries.get(file_id)
+            if summary is not None:
+                self.entries.move_to_end(file_id)
+            return summary
+
+    def put(self, file_id: str, summary: str):
+        with self.lock:
+            self.entries[file_id] = summary
+            self.entries.move_to_end(file_id)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+@st.cache_resource
+def get_summary_cache() -> SummaryCache:
+    return SummaryCache(SUMMARY_CACHE_MAX_ENTRIES)
+
+class SummaryStreamError(Exception):
+    """
+    Raised when the backend reports that the summary stream ended before the LLM finished.
+    """
+
+def stream_summary(file_id: str):
+    """
+    Yields the document summary from the backend as it is being generated.
+    Raises SummaryStreamError if the stream ends with the backend's error marker.
+    """
+    pending = ""
+    with get_client().stream("POST", "/summarize_stream", json={"file_id": file_id}) as response:
+        response.raise_for_status()
+        for chunk in response.iter_text():
+            pending += chunk
+            # Hold back enough text to recognise the marker even if it is split across chunks
+            ready = len(pending) - len(STREAM_ERROR_MARKER)
+            if ready > 0:
+                yield pending[:ready]
+                pending = pending[ready:]
+    if pending.endswith(STREAM_ERROR_MARKER):
+        raise SummaryStreamError("The summary was interrupted before it finished. Please try again.")
+    if pending:
+        yield pending
+
+# The file_id is derived from the document content, so it is a sufficient cache key
+@st.cache_data(show_spinner=False)
+def get_questions(file_id: str) -> list:
+    """
+    Generates challenge questions for the uploaded document.
+    """
+    response = get_client().post("/generate_questions", json={"file_id": file_id})
+    response.raise_for_status()
+    return response.json().get("questions", [])
+
 st.title("AI Document Assistant")
 st.markdown("Upload a document (PDF or TXT) and interact with it using AI.")
 
@@ -30,6 +129,10 @@ if 'file_id' not in st.session_state:
     st.session_state.file_id = None
 if 'summary' not in st.session_state:
     st.session_state.summary = ""
+if 'summary_error' not in st.session_state:
+    st.session_state.summary_error = None # Set when streaming fails, so reruns don't retry silently
+if 'document_hash' not in st.session_state:
+    st.session_state.document_hash = None
 if 'interaction_mode' not in st.session_state:
     st.session_state.interaction_mode = None # 'ask_anything' or 'challenge_me'
 if 'generated_questions' not in st.session_state:
@@ -43,28 +146,31 @@ if 'evaluation_results' not in st.session_state:
 st.header("1. Upload Document (PDF/TXT)")
 uploaded_file = st.file_uploader("Choose a PDF or TXT file", type=["pdf", "txt"])
 
-if uploaded_file is not None and st.session_state.document_content is None:
+# Only upload when the selected file's content changes, so benign reruns never re-POST it
+file_bytes = uploaded_file.getvalue() if uploaded_file is not None else None
+current_hash = hashlib.sha256(file_bytes).hexdigest() if file_bytes is not None else None
+
+if current_hash is None:
+    # Clearing the uploader lets the same file be selected again to force a fresh upload
+    st.session_state.document_hash = None
+elif current_hash != st.session_state.document_hash:
     with st.spinner("Processing document... This may take a moment."):
-        files = {"file": (uploaded_file.name, uploaded_file.getvalue(), uploaded_file.type)}
         try:
-            response = requests.post(f"{BACKEND_URL}/upload_document", files=files)
-            response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
-            result = response.json()
-            st.session_state.file_id = result.get("file_id")
+            result = upload_to_backend(file_bytes, uploaded_file.name, uploaded_file.type)
+            st.session_state.file_id = result["file_id"]
             st.session_state.document_content = "Document uploaded and processed." # Placeholder, content is on backend
-            st.success(result.get("message", "Document uploaded successfully!"))
-
-            # Automatically generate summary after upload
-            with st.spinner("Generating summary..."):
-                summary_response = requests.post(f"{BACKEND_URL}/summarize", json={"file_id": st.session_state.file_id})
-                summary_response.raise_for_status()
-                st.session_state.summary = summary_response.json().get("summary", "Could not generate summary.")
-                st.session_state.interaction_mode = None # Reset mode after new upload
-                st.session_state.generated_questions = [] # Clear old questions
-                st.session_state.user_answers = {}
-                st.session_state.evaluation_results = []
-
-        except requests.exceptions.RequestException as e:
+            st.success(result["message"])
+
+            # The summary itself is streamed in the summary section unless it is already cached
+            st.session_state.document_hash = current_hash
+            st.session_state.summary = get_summary_cache().get(st.session_state.file_id) or ""
+            st.session_state.summary_error = None
+            st.session_state.interaction_mode = None # Reset mode after new upload
+            st.session_state.generated_questions = [] # Clear old questions
+            st.session_state.user_answers = {}
+            st.session_state.evaluation_results = []
+
+        except httpx.HTTPError as e:
             st.error(f"Error uploading or processing file: {e}")
             st.session_state.document_content = None # Reset if error
             st.session_state.file_id = None
@@ -74,10 +180,30 @@ if uploaded_file is not None and st.session_state.document_content is None:
             st.error(f"An unexpected error occurred: {e}")
 
 # --- Document Summary Section ---
+def retry_summary():
+    # Runs before the next script run, so the summary section streams again straight away
+    st.session_state.summary_error = None
+
 if st.session_state.document_content:
     st.header("2. Document Summary")
     if st.session_state.summary:
         st.info(st.session_state.summary)
+    elif st.session_state.file_id:
+        if not st.session_state.summary_error:
+            # Show tokens as they arrive instead of waiting for the full completion
+            try:
+                summary = st.write_stream(stream_summary(st.session_state.file_id))
+                if summary:
+                    st.session_state.summary = summary
+                    get_summary_cache().put(st.session_state.file_id, summary)
+                else:
+                    st.session_state.summary = "Could not generate summary."
+            except (httpx.HTTPError, SummaryStreamError) as e:
+                st.session_state.summary_error = str(e)
+        # A failed summary is only retried on request, not on every rerun
+        if st.session_state.summary_error:
+            st.error(f"Error generating summary: {st.session_state.summary_error}")
+            st.button("Retry summary", key="retry_summary_btn", on_click=retry_summary)
     else:
         st.warning("Summary not available. Please upload a document.")
 
@@ -99,16 +225,21 @@ if st.session_state.document_content:
             st.session_state.evaluation_results = []
 
 # --- Ask Anything Mode ---
-if st.session_state.interaction_mode == 'ask_anything':
+# Fragments rerun on their own, so interacting with a mode does not redraw the whole page
+@st.fragment
+def ask_anything_fragment(file_id: str):
+    """
+    Renders the Ask Anything mode for the uploaded document.
+    """
     st.header("Ask Anything (Contextual Understanding)")
     question = st.text_area("Your Question:", key="ask_question_input", height=100)
     if st.button("Get Answer", key="submit_ask_question_btn"):
-        if st.session_state.file_id and question:
+        if file_id and question:
             with st.spinner("Generating answer..."):
                 try:
-                    response = requests.post(
-                        f"{BACKEND_URL}/ask_question",
-                        json={"file_id": st.session_state.file_id, "question": question}
+                    response = get_client().post(
+                        "/ask_question",
+                        json={"file_id": file_id, "question": question}
                     )
                     response.raise_for_status()
                     result = response.json()
@@ -116,7 +247,7 @@ if st.session_state.interaction_mode == 'ask_anything':
                     st.write(result.get("answer", "No answer found."))
                     st.subheader("Justification:")
                     st.markdown(f"*{result.get('justification', 'No justification provided.')}*")
-                except requests.exceptions.RequestException as e:
+                except httpx.HTTPError as e:
                     st.error(f"Error getting answer: {e}")
                 except json.JSONDecodeError:
                     st.error("Received invalid JSON response from backend.")
@@ -124,20 +255,21 @@ if st.session_state.interaction_mode == 'ask_anything':
             st.warning("Please upload a document and enter a question.")
 
 # --- Challenge Me Mode ---
-elif st.session_state.interaction_mode == 'challenge_me':
+@st.fragment
+def challenge_me_fragment(file_id: str):
+    """
+    Renders the Challenge Me mode: question generation, answer form and evaluation results.
+    """
     st.header("Challenge Me (Logic-Based Question Generation)")
 
     if st.button("Generate Questions", key="generate_questions_btn"):
-        if st.session_state.file_id:
+        if file_id:
             with st.spinner("Generating questions..."):
                 try:
-                    response = requests.post(f"{BACKEND_URL}/generate_questions", json={"file_id": st.session_state.file_id})
-                    response.raise_for_status()
-                    result = response.json()
-                    st.session_state.generated_questions = result.get("questions", [])
+                    st.session_state.generated_questions = get_questions(file_id)
                     st.session_state.user_answers = {str(i): "" for i in range(len(st.session_state.generated_questions))}
                     st.session_state.evaluation_results = [] # Clear previous evaluations
-                except requests.exceptions.RequestException as e:
+                except httpx.HTTPError as e:
                     st.error(f"Error generating questions: {e}")
                 except json.JSONDecodeError:
                     st.error("Received invalid JSON response from backend.")
@@ -146,19 +278,24 @@ elif st.session_state.interaction_mode == 'challenge_me':
 
     if st.session_state.generated_questions:
         st.subheader("Your Challenge:")
-        for i, q_obj in enumerate(st.session_state.generated_questions):
-            question_text = q_obj.get("question", f"Question {i+1} not found.")
-            st.write(f"**Question {i+1}:** {question_text}")
-            user_answer = st.text_area(f"Your answer for Question {i+1}:",
-                                       value=st.session_state.user_answers.get(str(i), ""),
-                                       key=f"user_answer_{i}",
-                                       height=80)
-            st.session_state.user_answers[str(i)] = user_answer # Update session state on change
-
-        if st.button("Submit Answers", key="submit_challenge_answers_btn"):
-            if st.session_state.file_id:
+        # A form only reruns the script on submit, not while answers are being typed
+        with st.form("challenge_form"):
+            for i, q_obj in enumerate(st.session_state.generated_questions):
+                question_text = q_obj.get("question", f"Question {i+1} not found.")
+                st.write(f"**Question {i+1}:** {question_text}")
+                user_answer = st.text_area(f"Your answer for Question {i+1}:",
+                                           value=st.session_state.user_answers.get(str(i), ""),
+                                           key=f"user_answer_{i}",
+                                           height=80)
+                st.session_state.user_answers[str(i)] = user_answer # Update session state on submit
+            submitted = st.form_submit_button("Submit Answers")
+
+        if submitted:
+            if file_id:
                 st.session_state.evaluation_results = [] # Clear before re-evaluating
                 with st.spinner("Evaluating your answers..."):
+                    # Collect answered questions so they can be evaluated in a single batch request
+                    pending = []
                     for i, q_obj in enumerate(st.session_state.generated_questions):
                         question_text = q_obj.get("question")
                         user_answer = st.session_state.user_answers.get(str(i), "")
@@ -172,44 +309,62 @@ elif st.session_state.interaction_mode == 'challenge_me':
                             })
                             continue # Skip to next question
 
+                        pending.append((len(st.session_state.evaluation_results), question_text, user_answer))
+                        st.session_state.evaluation_results.append(None) # Filled in once the batch returns
+
+                    if pending:
                         try:
-                            response = requests.post(
-                                f"{BACKEND_URL}/evaluate_answer",
+                            response = get_client().post(
+                                "/evaluate_answers",
                                 json={
-                                    "file_id": st.session_state.file_id,
-                                    "question": question_text,
-                                    "user_answer": user_answer
+                                    "file_id": file_id,
+                                    "items": [
+                                        {"question": question_text, "user_answer": user_answer}
+                                        for _, question_text, user_answer in pending
+                                    ]
                                 }
                             )
                             response.raise_for_status()
-                            result = response.json()
-                            st.session_state.evaluation_results.append({
-                                "question": question_text,
-                                "user_answer": user_answer,
-                                "evaluation": result.get("evaluation", "Could not evaluate."),
-                                "justification": result.get("justification", "No justification provided.")
-                            })
-                        except requests.exceptions.RequestException as e:
-                            st.error(f"Error evaluating answer for Q{i+1}: {e}")
-                            st.session_state.evaluation_results.append({
-                                "question": question_text,
-                                "user_answer": user_answer,
-                                "evaluation": "Error during evaluation.",
-                                "justification": str(e)
-                            })
+                            results = response.json().get("results", [])
+                            for (slot, question_text, user_answer), result in zip(pending, results):
+                                st.session_state.evaluation_results[slot] = {
+                                    "question": question_text,
+                                    "user_answer": user_answer,
+                                    "evaluation": result.get("evaluation", "Could not evaluate."),
+                                    "justification": result.get("justification", "No justification provided.")
+                                }
+                        except httpx.HTTPError as e:
+                            st.error(f"Error evaluating answers: {e}")
+                            for slot, question_text, user_answer in pending:
+                                st.session_state.evaluation_results[slot] = {
+                                    "question": question_text,
+                                    "user_answer": user_answer,
+                                    "evaluation": "Error during evaluation.",
+                                    "justification": str(e)
+                                }
                         except json.JSONDecodeError:
-                            st.error(f"Invalid JSON response for Q{i+1} evaluation.")
-                            st.session_state.evaluation_results.append({
-                                "question": question_text,
-                                "user_answer": user_answer,
-                                "evaluation": "Error: Invalid response.",
-                                "justification": "Backend returned invalid JSON."
-                            })
+                            st.error("Invalid JSON response for answer evaluation.")
+                            for slot, question_text, user_answer in pending:
+                                st.session_state.evaluation_results[slot] = {
+                                    "question": question_text,
+                                    "user_answer": user_answer,
+                                    "evaluation": "Error: Invalid response.",
+                                    "justification": "Backend returned invalid JSON."
+                                }
+
+                        # Any slot the backend did not answer for is reported rather than left empty
+                        for slot, question_text, user_answer in pending:
+                            if st.session_state.evaluation_results[slot] is None:
+                                st.session_state.evaluation_results[slot] = {
+                                    "question": question_text,
+                                    "user_answer": user_answer,
+                                    "evaluation": "Could not evaluate.",
+                                    "justification": "No justification provided."
+                                }
             else:
                 st.warning("Please upload a document first.")
-            st.rerun() # Changed from st.experimental_rerun()
 
-        # Display Evaluation Results
+        # Display Evaluation Results (rendered in the same run that produced them, no rerun needed)
         if st.session_state.evaluation_results:
             st.subheader("Evaluation Results:")
             for i, eval_data in enumerate(st.session_state.evaluation_results):
@@ -228,4 +383,10 @@ elif st.session_state.interaction_mode == 'challenge_me':
                 else:
                     st.info(f"**Evaluation:** {eval_data['evaluation']}")
 
-                st.markdown(f"**Justification:** *{eval_data['justification']}*")
\ No newline at end of file
+                st.markdown(f"**Justification:** *{eval_data['justification']}*")
+
+# --- Render Selected Mode ---
+if st.session_state.interaction_mode == 'ask_anything':
+    ask_anything_fragment(st.session_state.file_id)
+elif st.session_state.interaction_mode == 'challenge_me':
+    challenge_me_fragment(st.session_state.file_id)
@@ -1,14 +1,19 @@
 
-from fastapi import FastAPI, UploadFile, File, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Request, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
+from typing import Callable, List
+from collections import OrderedDict
 import uvicorn
+import asyncio
+import hashlib
 import io
 import json
 import os
-import re
-import requests # For making HTTP requests to the LLM API
+import threading
+import zlib
+import httpx # Async HTTP client for making requests to the LLM API
 from dotenv import load_dotenv # Import load_dotenv
 
 # Load environment variables from .env file
@@ -20,6 +25,24 @@ try:
 except ImportError:
     import pypdf as PyPDF2
 
+# Prefer pypdfium2 (bindings to the C++ PDFium library) for fast text extraction;
+# PyPDF2/pypdf is used when it is not installed or cannot read a file.
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+
+# PDFium is not thread-safe, so extractions running in the executor must not overlap
+PDFIUM_LOCK = threading.Lock()
+
+# Use tiktoken to cut the document excerpt by tokens; fall back to a character cut if it is
+# not installed or its encoding files cannot be loaded.
+try:
+    import tiktoken
+    TOKEN_ENCODING = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    TOKEN_ENCODING = None
+
 app = FastAPI()
 
 # Configure CORS to allow communication from the Streamlit frontend.
@@ -35,7 +58,26 @@ app.add_middleware(
 # In a real application, document content would be stored in a more persistent/scalable way,
 # e.g., a database, object storage, or a vector store.
 # For this demo, we'll keep it in memory for simplicity.
-document_content_store = {} # Stores document content per session/user, keyed by a simple ID
+# Each entry holds the full text, the excerpt sent to the LLM and the sha256 of the raw upload.
+# The store is bounded: once full, the least recently used document is evicted.
+DOCUMENT_STORE_MAX_ENTRIES = 64
+DOCUMENT_EXCERPT_TOKENS = 6000 # Leaves room for the prompt and completion in llama3's 8192-token window
+DOCUMENT_EXCERPT_CHARS = 8000 # Character limit used when tiktoken is unavailable
+MAX_DOCUMENT_BYTES = 50 * 1024 * 1024 # Largest upload accepted, measured after decompression
+document_content_store = OrderedDict() # Stores document content keyed by a content-derived file_id
+
+def get_document(file_id: str):
+    entry = document_content_store.get(file_id)
+    if entry is not None:
+        document_content_store.move_to_end(file_id)
+    return entry
+
+def store_document(file_id: str, entry: dict):
+    document_content_store[file_id] = entry
+    document_content_store.move_to_end(file_id)
+    while len(document_content_store) > DOCUMENT_STORE_MAX_ENTRIES:
+        evicted_file_id, _ = document_content_store.popitem(last=False)
+        invalidate_llm_cache(evicted_file_id)
 
 # --- LLM API Configuration (Updated for Groq) ---
 # Get API key from environment variables.
@@ -44,12 +86,85 @@ GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 GROQ_API_URL = "https://api.groq.com/openai/v1/chat/completions" # Groq's OpenAI-compatible endpoint
 GROQ_MODEL_NAME = "llama3-8b-8192" # Or "mixtral-8x7b-32768", or "gemma-7b-it"
 
+# Appended to a streamed response that ended before the LLM finished, since the HTTP status has
+# already been sent. Clients must treat a body ending with it as a failure (see app.py).
+STREAM_ERROR_MARKER = "\n[[stream interrupted]]"
+
+# Shared async HTTP client, created on startup and reused across requests so LLM calls
+# never block the event loop. Keep-alive pooling and HTTP/2 let concurrent calls reuse one
+# TLS connection to Groq instead of handshaking on every request.
+http_client: httpx.AsyncClient = None
+HTTP_CLIENT_LIMITS = httpx.Limits(max_keepalive_connections=20, max_connections=50)
+HTTP_CLIENT_TIMEOUT = httpx.Timeout(60.0, connect=5.0)
+
+# Process-wide cap on Groq requests in flight, shared by every endpoint, to stay under Groq rate limits.
+# Created on startup with the client so it belongs to the server's event loop.
+GROQ_MAX_CONCURRENT_REQUESTS = 8
+groq_semaphore: asyncio.Semaphore = None
+
+@app.on_event("startup")
+async def startup_http_client():
+    global http_client, groq_semaphore
+    http_client = httpx.AsyncClient(http2=True, limits=HTTP_CLIENT_LIMITS, timeout=HTTP_CLIENT_TIMEOUT)
+    groq_semaphore = asyncio.Semaphore(GROQ_MAX_CONCURRENT_REQUESTS)
+
+@app.on_event("shutdown")
+async def shutdown_http_client():
+    if http_client is not None:
+        await http_client.aclose()
+
+# --- LLM Response Cache ---
+# Identical prompts for the same document return the stored response instead of re-hitting Groq.
+LLM_CACHE_MAX_ENTRIES = 256
+llm_response_cache = OrderedDict() # (file_id, sha256 of prompt) -> response, least recently used first
+
+def llm_cache_key(file_id: str, prompt: str, system: str = None):
+    digest = hashlib.sha256((system or "").encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(prompt.encode("utf-8"))
+    return (file_id, digest.hexdigest())
+
+def get_cached_llm_response(key):
+    if key not in llm_response_cache:
+        return None
+    llm_response_cache.move_to_end(key)
+    return llm_response_cache[key]
+
+def store_llm_response(key, response):
+    llm_response_cache[key] = response
+    llm_response_cache.move_to_end(key)
+    while len(llm_response_cache) > LLM_CACHE_MAX_ENTRIES:
+        llm_response_cache.popitem(last=False)
+
+def invalidate_llm_cache(file_id: str):
+    for key in [key for key in llm_response_cache if key[0] == file_id]:
+        del llm_response_cache[key]
+
 # --- Helper Function for LLM API Calls (Updated for Groq) ---
-async def call_llm_api(prompt: str, response_schema: dict = None):
+def build_llm_messages(prompt: str, system: str = None):
+    """
+    Builds the chat messages for a request. The optional system message carries the document,
+    which stays byte-identical across calls so Groq's prompt cache can reuse the prefix.
+    """
+    # Groq uses an OpenAI-compatible chat completions format
+    messages = [{"role": "system", "content": system}] if system else []
+    messages.append({"role": "user", "content": prompt})
+    return messages
+
+async def call_llm_api(prompt: str, json_mode: bool = False, file_id: str = None, system: str = None,
+                       is_valid: Callable[[object], bool] = None):
     """
     Makes a request to the LLM API (Groq) for text generation.
-    Supports structured JSON responses if a schema is provided.
+    With json_mode, Groq's JSON mode is requested and the parsed object is returned.
+    Responses are cached per document when a file_id is given; if is_valid is provided,
+    only responses it accepts are cached, so a malformed reply can be retried.
     """
+    cache_key = llm_cache_key(file_id, prompt, system) if file_id else None
+    if cache_key:
+        cached = get_cached_llm_response(cache_key)
+        if cached is not None:
+            return cached
+
     if not GROQ_API_KEY:
         raise HTTPException(status_code=500, detail="Groq API Key is not set. Please check your .env file or environment variables.")
 
@@ -58,19 +173,17 @@ async def call_llm_api(prompt: str, response_schema: dict = None):
         'Authorization': f'Bearer {GROQ_API_KEY}'
     }
 
-    # Groq uses an OpenAI-compatible chat completions format
-    messages = [{"role": "user", "content": prompt}]
-
     payload = {
         "model": GROQ_MODEL_NAME,
-        "messages": messages,
+        "messages": build_llm_messages(prompt, system),
         "temperature": 0.7, # You can adjust temperature
         "max_tokens": 1024, # Adjust max tokens as needed
-        "response_format": {"type": "json_object"} if response_schema else {"type": "text"}
+        "response_format": {"type": "json_object"} if json_mode else {"type": "text"}
     }
 
     try:
-        response = requests.post(GROQ_API_URL, headers=headers, json=payload)
+        async with groq_semaphore:
+            response = await http_client.post(GROQ_API_URL, headers=headers, json=payload)
         response.raise_for_status() # Raise an exception for HTTP errors (4xx or 5xx)
         result = response.json()
 
@@ -79,51 +192,216 @@ async def call_llm_api(prompt: str, response_schema: dict = None):
            result["choices"][0]["message"].get("content"):
             text_response = result["choices"][0]["message"]["content"]
 
-            if response_schema:
+            # Some JSON-mode responses already carry the object itself rather than a string
+            if json_mode and not isinstance(text_response, dict):
                 try:
-                    return json.loads(text_response)
+                    text_response = json.loads(text_response)
                 except json.JSONDecodeError:
                     print(f"Error decoding JSON from LLM: {text_response}")
                     raise HTTPException(status_code=500, detail="LLM response was not valid JSON.")
+            if cache_key and (is_valid is None or is_valid(text_response)):
+                store_llm_response(cache_key, text_response)
             return text_response
         else:
             print(f"Unexpected LLM response structure: {result}")
             raise HTTPException(status_code=500, detail="LLM did not return a valid response.")
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         print(f"Network or API error calling LLM: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to connect to LLM service: {e}")
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {e}")
 
-# --- Document Processing Endpoints (No Change) ---
+async def stream_llm_api(prompt: str, file_id: str = None, system: str = None):
+    """
+    Streams a completion from the LLM API (Groq), yielding text chunks as they arrive.
+    Errors after the stream has started cannot change the HTTP status, so they end the stream
+    with STREAM_ERROR_MARKER. A stream that completes is cached like a call_llm_api response when a file_id is given.
+    """
+    cache_key = llm_cache_key(file_id, prompt, system) if file_id else None
+    if cache_key:
+        cached = get_cached_llm_response(cache_key)
+        if cached is not None:
+            yield cached
+            return
+
+    headers = {
+        'Content-Type': 'application/json',
+        'Authorization': f'Bearer {GROQ_API_KEY}'
+    }
+
+    payload = {
+        "model": GROQ_MODEL_NAME,
+        "messages": build_llm_messages(prompt, system),
+        "temperature": 0.7,
+        "max_tokens": 1024,
+        "stream": True
+    }
+
+    completed = False
+    try:
+        async with groq_semaphore, http_client.stream("POST", GROQ_API_URL, headers=headers, json=payload) as response:
+            response.raise_for_status()
+            # Groq streams OpenAI-style server-sent events: "data: {...}" lines ending with "data: [DONE]"
+            chunks = []
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    completed = True
+                    if cache_key and chunks:
+                        store_llm_response(cache_key, "".join(chunks))
+                    break
+                content = json.loads(data)["choices"][0]["delta"].get("content")
+                if content:
+                    chunks.append(content)
+                    yield content
+    except httpx.HTTPError as e:
+        print(f"Network or API error streaming from LLM: {e}")
+    except (json.JSONDecodeError, KeyError, IndexError) as e:
+        print(f"Unexpected LLM stream chunk: {e}")
+
+    if not completed:
+        yield STREAM_ERROR_MARKER
+
+def split_labeled_response(response_text: str, label: str):
+    """
+    Splits a "<label>: ... Justification: ..." LLM response without regexes.
+    Like the previous regexes, both markers are matched case-insensitively and anywhere in the
+    reply, so a preamble before the label or a single-line reply still splits correctly.
+    Returns the labeled value and the justification (None if either is missing).
+    """
+    lowered = response_text.lower()
+    marker = "justification:"
+    index = lowered.find(marker)
+    if index == -1:
+        head, justification = response_text, None
+    else:
+        head, justification = response_text[:index], response_text[index + len(marker):].strip() or None
+    label_index = lowered.find(label.lower(), 0, len(head))
+    if label_index != -1:
+        head = head[label_index + len(label):]
+    return head.strip() or None, justification
+
+# --- Document Processing Endpoints ---
+
+def build_excerpt(text: str) -> str:
+    """
+    Truncates document text to the excerpt sent to the LLM, computed once at upload.
+    cl100k_base only approximates llama3's tokenizer, which is fine for a context budget.
+    """
+    if TOKEN_ENCODING is None:
+        return text[:DOCUMENT_EXCERPT_CHARS]
+    # No token is longer than a few dozen characters, so there is no need to encode the whole document
+    tokens = TOKEN_ENCODING.encode(text[:DOCUMENT_EXCERPT_TOKENS * 32], disallowed_special=())
+    return TOKEN_ENCODING.decode(tokens[:DOCUMENT_EXCERPT_TOKENS])
+
+def extract_pdf_text_pdfium(raw: bytes) -> str:
+    """
+    Extracts the text of every page of a PDF using pypdfium2.
+    """
+    with PDFIUM_LOCK:
+        pdf = pdfium.PdfDocument(raw)
+        try:
+            pages = []
+            for page in pdf:
+                textpage = page.get_textpage()
+                pages.append(textpage.get_text_range())
+                textpage.close()
+                page.close()
+            return "\n".join(pages)
+        finally:
+            pdf.close()
+
+def extract_pdf_text(raw: bytes) -> str:
+    """
+    Extracts the text of every page of a PDF, using pypdfium2 when available and PyPDF2 otherwise.
+    """
+    if pdfium is not None:
+        try:
+            return extract_pdf_text_pdfium(raw)
+        except pdfium.PdfiumError as e:
+            print(f"pypdfium2 could not read the PDF, falling back to PyPDF2: {e}")
+
+    pdf_reader = PyPDF2.PdfReader(io.BytesIO(raw))
+    return "\n".join(page.extract_text() or "" for page in pdf_reader.pages)
+
+def gunzip_limited(data: bytes, max_size: int) -> bytes:
+    """
+    Decompresses a gzip request body without ever expanding it beyond max_size bytes,
+    so a small malicious body cannot exhaust memory.
+    """
+    decompressor = zlib.decompressobj(wbits=31) # wbits=31 expects a gzip header and trailer
+    decompressed = decompressor.decompress(data, max_size + 1)
+    if len(decompressed) <= max_size:
+        decompressed += decompressor.flush()
+    if len(decompressed) > max_size:
+        raise HTTPException(status_code=413, detail=f"Document is larger than {max_size // (1024 * 1024)} MB once decompressed.")
+    if not decompressor.eof:
+        raise EOFError("Compressed file ended before the end-of-stream marker was reached")
+    return decompressed
 
 @app.post("/upload_document")
-async def upload_document(file: UploadFile = File(...)):
+async def upload_document(request: Request, filename: str = "document"):
     """
     Uploads a document (PDF or TXT), extracts its content, and stores it.
+    Accepts either a multipart form with a "file" field, or the raw file as the request body
+    (optionally gzip-compressed via Content-Encoding) with its name in the "filename" query parameter.
     """
-    file_id = "user_document" # Simple ID for demo. In production, use session/user ID.
     extracted_text = ""
 
     try:
-        if file.content_type == "text/plain":
-            extracted_text = (await file.read()).decode("utf-8")
-        elif file.content_type == "application/pdf":
-            # Use PyPDF2 to read PDF content from bytes
-            pdf_reader = PyPDF2.PdfReader(io.BytesIO(await file.read()))
-            for page_num in range(len(pdf_reader.pages)):
-                page = pdf_reader.pages[page_num]
-                extracted_text += page.extract_text() + "\n"
+        content_type = request.headers.get("content-type", "").split(";")[0].strip()
+        if content_type == "multipart/form-data":
+            form = await request.form()
+            file = form.get("file")
+            if file is None or isinstance(file, str):
+                raise HTTPException(status_code=400, detail="No file was uploaded.")
+            raw = await file.read()
+            content_type = file.content_type
+            filename = file.filename
         else:
-            raise HTTPException(status_code=400, detail="Unsupported file type. Only PDF and TXT are supported.")
-
-        if not extracted_text.strip():
-            raise HTTPException(status_code=400, detail="Could not extract text from the document. It might be a scanned PDF without text layer.")
+            raw = await request.body()
+            if request.headers.get("content-encoding", "").lower() == "gzip":
+                try:
+                    raw = gunzip_limited(raw, MAX_DOCUMENT_BYTES)
+                except (OSError, EOFError, zlib.error) as e:
+                    raise HTTPException(status_code=400, detail=f"Invalid gzip request body: {e}")
+
+        if len(raw) > MAX_DOCUMENT_BYTES:
+            raise HTTPException(status_code=413, detail=f"Document is larger than {MAX_DOCUMENT_BYTES // (1024 * 1024)} MB.")
+
+        sha256 = hashlib.sha256(raw).hexdigest()
+        # Derive the ID from the content so concurrent users never overwrite each other's documents
+        file_id = sha256[:16]
+
+        # Skip extraction entirely if this exact document has already been processed
+        entry = get_document(file_id)
+        if entry is None:
+            if content_type == "text/plain":
+                extracted_text = raw.decode("utf-8")
+            elif content_type == "application/pdf":
+                # Extraction is CPU-bound, so run it off the event loop
+                extracted_text = await asyncio.get_running_loop().run_in_executor(None, extract_pdf_text, raw)
+            else:
+                raise HTTPException(status_code=400, detail="Unsupported file type. Only PDF and TXT are supported.")
+
+            if not extracted_text.strip():
+                raise HTTPException(status_code=400, detail="Could not extract text from the document. It might be a scanned PDF without text layer.")
+
+            entry = {
+                "text": extracted_text,
+                "excerpt": build_excerpt(extracted_text),
+                "sha256": sha256
+            }
+            store_document(file_id, entry)
 
-        document_content_store[file_id] = extracted_text
-        return JSONResponse(content={"message": f"File '{file.filename}' processed successfully.", "file_id": file_id})
+        start_questions_warmup(file_id, entry)
+        return JSONResponse(content={"message": f"File '{filename}' processed successfully.", "file_id": file_id})
 
+    except HTTPException as e:
+        raise e
     except Exception as e:
         print(f"Error processing document: {e}")
         raise HTTPException(status_code=500, detail=f"Error processing document: {e}")
@@ -136,31 +414,51 @@ class DocumentRequest(BaseModel):
 class SummarizeRequest(DocumentRequest):
     pass
 
+def build_document_system_prompt(truncated_document: str) -> str:
+    """
+    Shared system message for every prompt about a document. It must not vary between endpoints.
+    """
+    return f"""You are an assistant that answers using only the document below.
+
+    Document Content (excerpt):
+    {truncated_document}"""
+
+SUMMARY_PROMPT = "Summarize the document content in no more than 150 words. Focus on the main points and key takeaways."
+
 @app.post("/summarize")
 async def summarize_document(request: SummarizeRequest):
     """
     Generates a concise summary of the uploaded document.
     """
-    document_text = document_content_store.get(request.file_id)
-    if not document_text:
+    document = get_document(request.file_id)
+    if not document:
         raise HTTPException(status_code=404, detail="Document not found. Please upload a document first.")
 
-    # Truncate document content for LLM to manage token limits
-    truncated_document = document_text[:8000]
-
-    prompt = f"""Summarize the following document content in no more than 150 words. Focus on the main points and key takeaways.
-    Document Content:
-    {truncated_document}"""
+    system = build_document_system_prompt(document["excerpt"])
 
     try:
         # Call the updated LLM API function
-        summary = await call_llm_api(prompt)
+        summary = await call_llm_api(SUMMARY_PROMPT, file_id=request.file_id, system=system)
         return JSONResponse(content={"summary": summary})
     except HTTPException as e:
         raise e
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to generate summary: {e}")
 
+@app.post("/summarize_stream")
+async def summarize_document_stream(request: SummarizeRequest):
+    """
+    Streams the summary of the uploaded document as plain text while it is being generated.
+    """
+    document = get_document(request.file_id)
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found. Please upload a document first.")
+    if not GROQ_API_KEY:
+        raise HTTPException(status_code=500, detail="Groq API Key is not set. Please check your .env file or environment variables.")
+
+    system = build_document_system_prompt(document["excerpt"])
+    return StreamingResponse(stream_llm_api(SUMMARY_PROMPT, request.file_id, system), media_type="text/plain; charset=utf-8")
+
 class AskQuestionRequest(DocumentRequest):
     question: str
 
@@ -169,32 +467,28 @@ async def ask_question(request: AskQuestionRequest):
     """
     Answers a free-form question based on the document content, with justification.
     """
-    document_text = document_content_store.get(request.file_id)
-    if not document_text:
+    document = get_document(request.file_id)
+    if not document:
         raise HTTPException(status_code=404, detail="Document not found. Please upload a document first.")
 
-    truncated_document = document_text[:8000]
+    system = build_document_system_prompt(document["excerpt"])
 
-    prompt = f"""Based on the following document content, answer the question accurately and concisely.
+    prompt = f"""Based on the document content, answer the question accurately and concisely.
     After the answer, provide a brief justification from the document, citing the relevant section or paragraph if possible.
     Format your response as:
     Answer: [Your Answer]
     Justification: [Your Justification from the document, e.g., "This is supported by paragraph 3 of section 1..."]
 
-    Document Content (excerpt):
-    {truncated_document}
-
     Question: {request.question}"""
 
     try:
         # Call the updated LLM API function
-        response_text = await call_llm_api(prompt)
+        response_text = await call_llm_api(prompt, file_id=request.file_id, system=system)
         # Parse the response to separate answer and justification
-        answer_match = re.search(r"Answer: ([\s\S]*?)(?=\nJustification:|$)", response_text, re.IGNORECASE)
-        justification_match = re.search(r"Justification: ([\s\S]*)", response_text, re.IGNORECASE)
+        answer, justification = split_labeled_response(response_text, "Answer:")
 
-        answer = answer_match.group(1).strip() if answer_match else "Could not extract answer."
-        justification = justification_match.group(1).strip() if justification_match else "No justification provided."
+        answer = answer or "Could not extract answer."
+        justification = justification or "No justification provided."
 
         return JSONResponse(content={"answer": answer, "justification": justification})
     except HTTPException as e:
@@ -202,50 +496,62 @@ async def ask_question(request: AskQuestionRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get answer: {e}")
 
-@app.post("/generate_questions")
-async def generate_questions(request: DocumentRequest):
+def has_questions(response_json) -> bool:
+    return isinstance(response_json, dict) and "questions" in response_json
+
+async def generate_document_questions(file_id: str, document: dict) -> list:
     """
-    Generates three logic-based or comprehension-focused questions from the document.
+    Generates three logic-based or comprehension-focused questions for a stored document.
+    Repeat calls for the same document are served from the LLM response cache.
     """
-    document_text = document_content_store.get(request.file_id)
-    if not document_text:
-        raise HTTPException(status_code=404, detail="Document not found. Please upload a document first.")
-
-    truncated_document = document_text[:8000]
+    system = build_document_system_prompt(document["excerpt"])
 
-    prompt = f"""Generate three (3) distinct, logic-based or comprehension-focused questions derived from the following document.
+    prompt = """Generate three (3) distinct, logic-based or comprehension-focused questions derived from the document.
     The questions should require understanding and inference, not just direct recall.
     Provide the questions in a JSON array format, where each object has a "question" key.
-    Example: {{"questions": [{{"question": "What is the primary implication of X on Y?"}}, {{"question": "How does A relate to B in the context of C?"}}, {{"question": "Based on the text, what is a potential consequence of Z?"}}]}}
-
-    Document Content (excerpt):
-    {truncated_document}"""
+    Example: {"questions": [{"question": "What is the primary implication of X on Y?"}, {"question": "How does A relate to B in the context of C?"}, {"question": "Based on the text, what is a potential consequence of Z?"}]}"""
+
+    # The expected shape is described in the prompt; Groq's JSON mode only guarantees valid JSON
+    response_json = await call_llm_api(prompt, json_mode=True, file_id=file_id, system=system,
+                                       is_valid=has_questions)
+    if has_questions(response_json):
+        return response_json["questions"]
+    raise HTTPException(status_code=500, detail="LLM did not return questions in the expected format.")
+
+# --- Background Question Warm-up ---
+# Questions are generated as soon as a document is uploaded, so they are usually ready (in the
+# LLM response cache) by the time the user opens Challenge Me.
+questions_warmup_tasks = {} # file_id -> in-flight background question generation
+
+def start_questions_warmup(file_id: str, document: dict):
+    if file_id in questions_warmup_tasks:
+        return
+    task = asyncio.create_task(generate_document_questions(file_id, document))
+    questions_warmup_tasks[file_id] = task
+    task.add_done_callback(lambda done: finish_questions_warmup(file_id, done))
+
+def finish_questions_warmup(file_id: str, task: asyncio.Task):
+    questions_warmup_tasks.pop(file_id, None)
+    if not task.cancelled() and task.exception() is not None:
+        print(f"Background question generation failed for {file_id}: {task.exception()}")
 
-    # JSON schema for the expected response format
-    schema = {
-        "type": "OBJECT",
-        "properties": {
-            "questions": {
-                "type": "ARRAY",
-                "items": {
-                    "type": "OBJECT",
-                    "properties": {
-                        "question": {"type": "STRING"}
-                    },
-                    "required": ["question"]
-                }
-            }
-        },
-        "required": ["questions"]
-    }
+@app.post("/generate_questions")
+async def generate_questions(request: DocumentRequest):
+    """
+    Generates three logic-based or comprehension-focused questions from the document.
+    """
+    document = get_document(request.file_id)
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found. Please upload a document first.")
 
     try:
-        # Call the updated LLM API function
-        response_json = await call_llm_api(prompt, schema)
-        if response_json and "questions" in response_json:
-            return JSONResponse(content={"questions": response_json["questions"]})
-        else:
-            raise HTTPException(status_code=500, detail="LLM did not return questions in the expected format.")
+        # Wait for an in-flight warm-up instead of issuing a duplicate LLM call; once it has
+        # finished the questions come straight from the cache (or are retried if it failed).
+        task = questions_warmup_tasks.get(request.file_id)
+        if task is not None:
+            await asyncio.wait([task])
+        questions = await generate_document_questions(request.file_id, document)
+        return JSONResponse(content={"questions": questions})
     except HTTPException as e:
         raise e
     except Exception as e:
@@ -256,45 +562,84 @@ class EvaluateAnswerRequest(BaseModel):
     question: str
     user_answer: str
 
-@app.post("/evaluate_answer")
-async def evaluate_answer(request: EvaluateAnswerRequest):
-    """
-    Evaluates a user's answer to a generated question, with feedback and justification.
-    """
-    document_text = document_content_store.get(request.file_id)
-    if not document_text:
-        raise HTTPException(status_code=404, detail="Document not found. Please upload a document first.")
+class EvaluateItem(BaseModel):
+    question: str
+    user_answer: str
 
-    truncated_document = document_text[:8000]
+class EvaluateAnswersBatchRequest(BaseModel):
+    file_id: str
+    items: List[EvaluateItem]
 
-    prompt = f"""Evaluate the following user's answer to the question based on the provided document content.
+async def evaluate_one(file_id: str, system: str, question: str, user_answer: str):
+    """
+    Evaluates a single answer against the document system prompt and returns the parsed result.
+    """
+    prompt = f"""Evaluate the following user's answer to the question based on the document content.
     Provide feedback on correctness (e.g., "Correct", "Partially Correct", "Incorrect") and a brief justification from the document.
     Format your response as:
     Evaluation: [Feedback on correctness]
     Justification: [Your justification from the document, e.g., "This is supported by paragraph X of section Y..."]
 
-    Document Content (excerpt):
-    {truncated_document}
+    Question: {question}
+    User's Answer: {user_answer}"""
 
-    Question: {request.question}
-    User's Answer: {request.user_answer}"""
+    # Call the updated LLM API function
+    response_text = await call_llm_api(prompt, file_id=file_id, system=system)
+    # Parse the response to separate evaluation and justification
+    evaluation, justification = split_labeled_response(response_text, "Evaluation:")
 
-    try:
-        # Call the updated LLM API function
-        response_text = await call_llm_api(prompt)
-        # Parse the response to separate evaluation and justification
-        evaluation_match = re.search(r"Evaluation: ([\s\S]*?)(?=\nJustification:|$)", response_text, re.IGNORECASE)
-        justification_match = re.search(r"Justification: ([\s\S]*)", response_text, re.IGNORECASE)
+    evaluation = evaluation or "No evaluation provided."
+    justification = justification or "No justification provided."
 
-        evaluation = evaluation_match.group(1).strip() if evaluation_match else "No evaluation provided."
-        justification = justification_match.group(1).strip() if justification_match else "No justification provided."
+    return {"evaluation": evaluation, "justification": justification}
 
-        return JSONResponse(content={"evaluation": evaluation, "justification": justification})
+@app.post("/evaluate_answer")
+async def evaluate_answer(request: EvaluateAnswerRequest):
+    """
+    Evaluates a user's answer to a generated question, with feedback and justification.
+    """
+    document = get_document(request.file_id)
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found. Please upload a document first.")
+
+    system = build_document_system_prompt(document["excerpt"])
+
+    try:
+        result = await evaluate_one(request.file_id, system, request.question, request.user_answer)
+        return JSONResponse(content=result)
     except HTTPException as e:
         raise e
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to evaluate answer: {e}")
 
+@app.post("/evaluate_answers")
+async def evaluate_answers(request: EvaluateAnswersBatchRequest):
+    """
+    Evaluates several answers in one request, running the LLM calls concurrently.
+    """
+    document = get_document(request.file_id)
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found. Please upload a document first.")
+
+    # Build the document system prompt once and share it across all prompts
+    system = build_document_system_prompt(document["excerpt"])
+
+    # All evaluations run concurrently (bounded globally by groq_semaphore); a failure is
+    # reported for its own item only, since gather with return_exceptions never raises
+    outcomes = await asyncio.gather(
+        *[evaluate_one(request.file_id, system, item.question, item.user_answer) for item in request.items],
+        return_exceptions=True
+    )
+    results = []
+    for outcome in outcomes:
+        if isinstance(outcome, Exception):
+            detail = outcome.detail if isinstance(outcome, HTTPException) else str(outcome)
+            print(f"Error evaluating answer: {detail}")
+            results.append({"evaluation": "Error during evaluation.", "justification": detail})
+        else:
+            results.append(outcome)
+    return JSONResponse(content={"results": results})
+
 # To run the FastAPI app directly (for local testing outside of a combined setup)
 # if __name__ == "__main__":
 #     uvicorn.run(app, host="0.0.0.0", port=8000)